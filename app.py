@@ -1,16 +1,14 @@
-import json
-import os
-import time
+from datetime import datetime, timezone
 
 import numpy as np
-import pandas as pd
-import polars as pl
 import streamlit as st
-from streamlit_gsheets import GSheetsConnection
+
+from eval_core import get_data_mtime, load_source_data, recipe_md
+
+# The Sheets connection is created from its class path, so it is only
+# imported once the login page is past
 
 # --- CONFIGURATION ---
-# The CSV containing the recipes to evaluate (Read-Only)
-DATA_FILE = "Recipes evaluation - evaluation.csv"
 ANNOTATORS = ["Daniele", "Sebastiano", "Luca"]
 
 st.set_page_config(layout="wide", page_title="Recipe Eval (Google Sheets)")
@@ -41,111 +39,193 @@ current_user = st.session_state.annotator_name
 # ==========================================
 # 2. DATA LOADING & GOOGLE SHEETS
 # ==========================================
-@st.cache_data
-def load_source_data():
-    """Loads the source recipes from the local CSV."""
-    if not os.path.exists(DATA_FILE):
-        return []
-
-    df = pl.read_csv(DATA_FILE)
-    np.random.seed(42)
-    is_mixed_A = np.random.rand(len(df)) < 0.5
-
-    # Persist mapping if needed
-    if not os.path.exists("mapping_reference.csv"):
-        mapping = [
-            {"id": i, "Mixed_is": "A" if b else "B"} for i, b in enumerate(is_mixed_A)
-        ]
-        pl.DataFrame(mapping).write_csv("mapping_reference.csv")
-
-    prepared_data = []
-    # Adjust column names as needed based on your file
-    rows = df.select(
-        "title", "output_Qwen3-4B-Cross-Entropy", "output_Qwen3-4B-Mixed"
-    ).iter_rows()
-
-    for i, (row, mixed) in enumerate(zip(rows, is_mixed_A)):
-
-        def parse(val):
-            try:
-                if isinstance(val, (dict, list)):
-                    return val
-                return json.loads(val)
-            except:
-                return {"ingredients": [], "instructions": [str(val)]}
-
-        ce = parse(row[1])
-        mixed_out = parse(row[2])
-
-        prepared_data.append(
-            {
-                "ID": i,
-                "title": row[0],
-                "A": mixed_out if mixed else ce,
-                "B": ce if mixed else mixed_out,
-                "A_is": "Mixed" if mixed else "CE",  # NEW: Track model for A
-                "B_is": "CE" if mixed else "Mixed",  # NEW: Track model for B
-            }
-        )
-    return prepared_data
+# The same key for the frame and the per-sample caches, so they never mix
+# recipes from different versions of the CSV
+data_mtime = get_data_mtime()
+data = load_source_data(data_mtime)
 
 
-data = load_source_data()
-
 # Connect to Google Sheets
-conn = st.connection("gsheets", type=GSheetsConnection)
+conn = st.connection("gsheets", type="streamlit_gsheets.GSheetsConnection")
 
 
-def get_google_sheet_data():
-    """Reads the Google Sheet. Returns empty DF if sheet is empty."""
-    df = conn.read(ttl=0)
-    return df
-    try:
-        # ttl=0 means do not cache, always get fresh data
-        df = conn.read(ttl=0)
-        return df
-    except Exception:
-        return pd.DataFrame()
+@st.cache_resource
+def get_results_worksheet():
+    """Opens the results worksheet and reads its header row once.
 
+    The spreadsheet is resolved like the connection does: URL, then key,
+    then name. Without a configured worksheet the first tab is used, as
+    conn.read() does. The header list is kept in sync with row 1 on submit.
+    """
+    import gspread
 
-def save_to_google_sheet(new_record):
-    """Reads current sheet, appends new row, writes back."""
-    df_existing = get_google_sheet_data()
-    df_new = pd.DataFrame([new_record])
+    secrets = dict(st.secrets["connections"]["gsheets"])
+    spreadsheet = secrets.pop("spreadsheet")
+    worksheet_name = secrets.pop("worksheet", None)
+    client = gspread.service_account_from_dict(secrets)
 
-    # Concatenate
-    if not df_existing.empty:
-        df_combined = pd.concat([df_existing, df_new], ignore_index=True)
+    if spreadsheet.startswith("https://"):
+        sh = client.open_by_url(spreadsheet)
     else:
-        df_combined = df_new
+        try:
+            sh = client.open_by_key(spreadsheet)
+        except gspread.exceptions.SpreadsheetNotFound:
+            sh = client.open(spreadsheet)
+
+    worksheet = sh.worksheet(worksheet_name) if worksheet_name else sh.sheet1
+    return worksheet, worksheet.row_values(1)
+
+
+def get_completed_ids(annotator):
+    """Returns the sample IDs the given annotator has already evaluated."""
+    # Same tab the submissions are appended to
+    worksheet, _ = get_results_worksheet()
+    try:
+        # The whole sheet is still downloaded, usecols only skips parsing
+        # the other columns into the DataFrame
+        df = conn.read(
+            worksheet=worksheet.title, ttl=0, usecols=["sample_id", "annotator"]
+        )
+    except ValueError:
+        # Empty sheet or missing header
+        return set()
+
+    import pandas as pd
+
+    # We filter only rows where 'annotator' == annotator
+    user_rows = df[df["annotator"] == annotator]
+    # Blank or stray text cells would break the NumPy pending-ID lookup
+    sample_ids = pd.to_numeric(user_rows["sample_id"], errors="coerce")
+    return set(sample_ids.dropna().astype(int).tolist())
+
+
+def save_to_google_sheet(new_record):
+    """Appends a single row to the sheet, following its header order."""
+    worksheet, header = get_results_worksheet()
+
+    # Fields the sheet has no column for yet are added to the header row
+    missing = [col for col in new_record if col not in header]
+    if missing:
+        new_header = header + missing
+        if len(new_header) > worksheet.col_count:
+            worksheet.add_cols(len(new_header) - worksheet.col_count)
+        worksheet.update(
+            range_name="A1", values=[new_header], value_input_option="RAW"
+        )
+        header.extend(missing)
 
-    conn.update(data=df_combined)
+    # RAW keeps free text (notes starting with "=", "-", "+", ...) as typed
+    worksheet.append_row(
+        [new_record.get(col, "") for col in header],
+        value_input_option="RAW",
+    )
 
 
 # ==========================================
 # 3. PROGRESS TRACKING (User Specific)
 # ==========================================
-# Load the sheet data to check progress
-df_results = get_google_sheet_data()
-
 # Filter: Which IDs has THIS SPECIFIC USER completed?
-completed_ids = set()
-if (
-    not df_results.empty
-    and "sample_id" in df_results.columns
-    and "annotator" in df_results.columns
-):
-    # We filter only rows where 'annotator' == current_user
-    user_rows = df_results[df_results["annotator"] == current_user]
-    completed_ids = set(user_rows["sample_id"].unique())
+# Read once per login, then kept up to date locally on each submit
+if "completed_ids" not in st.session_state:
+    st.session_state.completed_ids = get_completed_ids(current_user)
+completed_ids = st.session_state.completed_ids
+
+
+def option_label(i, title):
+    """Navigation label, marked with ✅ only if THIS user has done it."""
+    return f"{i}: {title} {'✅' if i in completed_ids else ''}"
+
+
+# Built once per login and patched on submit instead of on every rerun
+if "options" not in st.session_state:
+    st.session_state.options = [
+        option_label(i, title) for i, title in enumerate(data["title"].to_list())
+    ]
+
+
+def get_pending_ids():
+    """Sorted IDs this user still has to evaluate, kept until the next submit."""
+    if "pending_ids" not in st.session_state:
+        st.session_state.pending_ids = np.setdiff1d(
+            np.arange(len(data)),
+            np.fromiter(completed_ids, dtype=np.int64, count=len(completed_ids)),
+            assume_unique=True,
+        )
+    return st.session_state.pending_ids
+
 
 if "current_idx" not in st.session_state:
     st.session_state.current_idx = 0
+if "nav" not in st.session_state:
+    st.session_state.nav = st.session_state.options[st.session_state.current_idx]
+
+
+# Navigation only happens in widget callbacks, which run before the rerun
+# Streamlit already does, so no explicit st.rerun() is needed
+def go_to(idx):
+    """Moves to a sample, keeping the navigation dropdown in sync."""
+    st.session_state.current_idx = idx
+    st.session_state.nav = st.session_state.options[idx]
 
 
 def go_next():
-    if st.session_state.current_idx < len(data) - 1:
-        st.session_state.current_idx += 1
+    go_to(min(st.session_state.current_idx + 1, len(data) - 1))
+
+
+def go_prev():
+    go_to(max(st.session_state.current_idx - 1, 0))
+
+
+def on_navigate():
+    st.session_state.current_idx = int(st.session_state.nav.split(":")[0])
+
+
+def go_next_pending():
+    pending_ids = get_pending_ids()
+    if len(pending_ids) > 0:
+        # First pending sample after the current one, wrapping around
+        pos = np.searchsorted(pending_ids, st.session_state.current_idx, side="right")
+        go_to(int(pending_ids[pos % len(pending_ids)]))
+
+
+def submit_evaluation(pair):
+    """Saves the form of the given sample and moves on to the next one."""
+    ss = st.session_state
+    sample_id = pair["ID"]
+    prefs = [ss[f"{k}_{sample_id}"] for k in ("pi", "pn", "pp", "pall")]
+    if not all(prefs):
+        # The form shows the error on this rerun
+        return
+
+    # Construct Record
+    record = {
+        "annotator": current_user,  # <--- VITAL for IAA
+        "sample_id": sample_id,
+        "recipe_title": pair["title"],
+        "pref_ingredients": ss[f"pi_{sample_id}"],
+        "pref_numbers": ss[f"pn_{sample_id}"],
+        "pref_procedure": ss[f"pp_{sample_id}"],
+        "pref_overall": ss[f"pall_{sample_id}"],
+        "A_cookable": ss[f"ac_{sample_id}"],
+        "A_trust": ss[f"at_{sample_id}"],
+        "A_errors": ";".join(ss[f"ae_{sample_id}"]),
+        "B_cookable": ss[f"bc_{sample_id}"],
+        "B_trust": ss[f"bt_{sample_id}"],
+        "B_errors": ";".join(ss[f"be_{sample_id}"]),
+        "notes": ss[f"nt_{sample_id}"],
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "A_model": pair["A_is"],  # NEW: Save model name
+        "B_model": pair["B_is"],  # NEW: Save model name
+    }
+
+    with st.spinner("Saving to Google Sheets..."):
+        save_to_google_sheet(record)
+    completed_ids.add(sample_id)
+    ss.pop("pending_ids", None)
+    ss.options[sample_id] = option_label(sample_id, pair["title"])
+
+    st.toast("Saved! Moving to next...")
+    go_next()
 
 
 # ==========================================
@@ -155,6 +235,10 @@ with st.sidebar:
     st.header(f"👤 {current_user}")
     if st.button("Log out", key="logout"):
         del st.session_state.annotator_name
+        del st.session_state.completed_ids
+        del st.session_state.options
+        st.session_state.pop("pending_ids", None)
+        st.session_state.pop("nav", None)
         st.rerun()
 
     st.divider()
@@ -168,30 +252,23 @@ with st.sidebar:
     st.markdown("---")
 
     # Navigation Dropdown
-    # We mark with ✅ only if THIS user has done it
-    options = [
-        f"{d['ID']}: {d['title']} {'✅' if d['ID'] in completed_ids else ''}"
-        for d in data
-    ]
-    selected_opt = st.selectbox(
-        "Navigate:", options, index=st.session_state.current_idx
+    st.selectbox(
+        "Navigate:", st.session_state.options, key="nav", on_change=on_navigate
     )
-    new_idx = int(selected_opt.split(":")[0])
-    if new_idx != st.session_state.current_idx:
-        st.session_state.current_idx = new_idx
-        st.rerun()
 
-    if st.button("⏭️ Find My Next Pending"):
-        for i in range(len(data)):
-            if data[i]["ID"] not in completed_ids:
-                st.session_state.current_idx = i
-                st.rerun()
+    if (
+        st.button("⏭️ Find My Next Pending", on_click=go_next_pending)
+        and len(get_pending_ids()) == 0
+    ):
         st.success("You have completed all samples!")
 
 # ==========================================
 # 5. MAIN UI
 # ==========================================
-current_pair = data[st.session_state.current_idx]
+# IDs are row positions; the raw outputs are only pulled by get_pair
+current_pair = data.select("ID", "title", "A_is", "B_is").row(
+    st.session_state.current_idx, named=True
+)
 sample_id = current_pair["ID"]
 
 st.title("👨‍🍳 Recipe Evaluation (ACL)")
@@ -206,25 +283,13 @@ st.markdown(f"## 🍽️ *{current_pair['title']}*")
 
 
 # --- Render Recipes ---
-def render(r):
-    st.markdown("#### Ingredients")
-    st.write(r.get("ingredients", []))
-    st.markdown("#### Instructions")
-    inst = r.get("instructions", [])
-    if isinstance(inst, list):
-        for i, s in enumerate(inst, 1):
-            st.markdown(f"**{i}.** {s}")
-    else:
-        st.write(inst)
-
-
 c1, c2 = st.columns(2)
 with c1:
     st.info("Versione A")
-    render(current_pair["A"])
+    st.markdown(recipe_md(sample_id, "A", data_mtime))
 with c2:
     st.success("Versione B")
-    render(current_pair["B"])
+    st.markdown(recipe_md(sample_id, "B", data_mtime))
 
 st.divider()
 
@@ -280,62 +345,33 @@ with st.form(key=f"form_{sample_id}"):
 
     with ec1:
         st.markdown("**Version A**")
-        ac = st.selectbox("Cookable?", ["Yes", "Maybe", "No"], key=f"ac_{sample_id}")
-        at = st.slider("Trust (1-5)", 1, 5, 3, key=f"at_{sample_id}")
-        ae = st.multiselect("Errors A", err_opts, key=f"ae_{sample_id}")
+        st.selectbox("Cookable?", ["Yes", "Maybe", "No"], key=f"ac_{sample_id}")
+        st.slider("Trust (1-5)", 1, 5, 3, key=f"at_{sample_id}")
+        st.multiselect("Errors A", err_opts, key=f"ae_{sample_id}")
 
     with ec2:
         st.markdown("**Version B**")
-        bc = st.selectbox("Cookable?", ["Yes", "Maybe", "No"], key=f"bc_{sample_id}")
-        bt = st.slider("Trust (1-5)", 1, 5, 3, key=f"bt_{sample_id}")
-        be = st.multiselect("Errors B", err_opts, key=f"be_{sample_id}")
-
-    notes = st.text_area("Notes", key=f"nt_{sample_id}")
-
-    # SUBMIT
-    submitted = st.form_submit_button("☁️ Save to Google Drive", type="primary")
-
-    if submitted:
-        if not all([p_ing, p_num, p_proc, p_all]):
-            st.error("Please fill all comparison fields.")
-        else:
-            # Construct Record
-            record = {
-                "annotator": current_user,  # <--- VITAL for IAA
-                "sample_id": sample_id,
-                "recipe_title": current_pair["title"],
-                "pref_ingredients": p_ing,
-                "pref_numbers": p_num,
-                "pref_procedure": p_proc,
-                "pref_overall": p_all,
-                "A_cookable": ac,
-                "A_trust": at,
-                "A_errors": ";".join(ae),
-                "B_cookable": bc,
-                "B_trust": bt,
-                "B_errors": ";".join(be),
-                "notes": notes,
-                "timestamp": str(pd.Timestamp.now()),
-                "A_model": current_pair["A_is"],  # NEW: Save model name
-                "B_model": current_pair["B_is"],  # NEW: Save model name
-            }
-
-            with st.spinner("Saving to Google Sheets..."):
-                save_to_google_sheet(record)
-
-            st.success("Saved! Moving to next...")
-            time.sleep(1)  # Brief pause to show success message
-            go_next()
-            st.rerun()
+        st.selectbox("Cookable?", ["Yes", "Maybe", "No"], key=f"bc_{sample_id}")
+        st.slider("Trust (1-5)", 1, 5, 3, key=f"bt_{sample_id}")
+        st.multiselect("Errors B", err_opts, key=f"be_{sample_id}")
+
+    st.text_area("Notes", key=f"nt_{sample_id}")
+
+    # SUBMIT (submit_evaluation reads the values above back by key)
+    submitted = st.form_submit_button(
+        "☁️ Save to Google Drive",
+        type="primary",
+        on_click=submit_evaluation,
+        args=(current_pair,),
+    )
+
+    # A valid submit has already moved on to the next sample's form
+    if submitted and not all([p_ing, p_num, p_proc, p_all]):
+        st.error("Please fill all comparison fields.")
 
 # Navigation Footer
 c_prev, c_next = st.columns([1, 1])
 with c_prev:
-    if st.button("⬅️ Prev"):
-        if st.session_state.current_idx > 0:
-            st.session_state.current_idx -= 1
-            st.rerun()
+    st.button("⬅️ Prev", on_click=go_prev)
 with c_next:
-    if st.button("Next ➡️"):
-        go_next()
-        st.rerun()
+    st.button("Next ➡️", on_click=go_next)
@@ -0,0 +1,169 @@
+import os
+
+import numpy as np
+import orjson
+import streamlit as st
+
+# Data loading and rendering helpers shared by the evaluation app.
+# polars is imported where it is used, so importing this module stays cheap.
+
+# --- CONFIGURATION ---
+# The CSV containing the recipes to evaluate (Read-Only)
+DATA_FILE = "Recipes evaluation - evaluation.csv"
+# Parsed recipes, rebuilt whenever DATA_FILE changes (mtime in the sidecar)
+CACHE_FILE = "prepared_cache.parquet"
+CACHE_MTIME_FILE = "prepared_cache.mtime"
+PREPARED_COLUMNS = ["ID", "title", "A_raw", "B_raw", "A_is", "B_is"]
+# Packed bitmap of the blind A/B assignment (1 = Mixed is A)
+MAPPING_FILE = "mapping.bin"
+
+
+def parse_recipe(val):
+    """Parses a model output, falling back to a single raw instruction."""
+    if isinstance(val, (dict, list)):
+        return val
+    try:
+        return orjson.loads(val)
+    except (TypeError, orjson.JSONDecodeError):
+        return {"ingredients": [], "instructions": [str(val)]}
+
+
+def read_prepared_cache():
+    """Returns the cached prepared data, or None if missing, stale or invalid."""
+    if not (os.path.exists(CACHE_FILE) and os.path.exists(CACHE_MTIME_FILE)):
+        return None
+    with open(CACHE_MTIME_FILE) as f:
+        if f.read().strip() != str(os.path.getmtime(DATA_FILE)):
+            return None
+
+    import polars as pl
+
+    try:
+        cached = pl.read_parquet(CACHE_FILE)
+    except (OSError, pl.exceptions.PolarsError):
+        return None
+    # A leftover file from another layout is rebuilt instead of crashing later
+    if not set(PREPARED_COLUMNS) <= set(cached.columns):
+        return None
+    return cached.select(PREPARED_COLUMNS)
+
+
+def write_prepared_cache(prepared_data):
+    """Persists the prepared data so cold starts skip re-reading the CSV."""
+    prepared_data.write_parquet(CACHE_FILE, compression="zstd")
+    with open(CACHE_MTIME_FILE, "w") as f:
+        f.write(str(os.path.getmtime(DATA_FILE)))
+
+
+def load_mixed_assignment(n):
+    """Returns which samples show Mixed as A, drawn once and then persisted."""
+    if os.path.exists(MAPPING_FILE):
+        raw = np.fromfile(MAPPING_FILE, dtype=np.uint8)
+        # 8-byte row count, then the bits packed (and zero-padded) to bytes
+        if len(raw) >= 8:
+            stored_n = int(raw[:8].view("<u8")[0])
+            if len(raw) == 8 + (stored_n + 7) // 8 and stored_n >= n:
+                return np.unpackbits(raw[8:])[:n].astype(bool)
+
+    # Same seed as always, so a longer draw keeps the existing prefix
+    np.random.seed(42)
+    is_mixed_A = np.random.rand(n) < 0.5
+    with open(MAPPING_FILE, "wb") as f:
+        np.array([n], dtype="<u8").tofile(f)
+        np.packbits(is_mixed_A).tofile(f)
+    return is_mixed_A
+
+
+@st.cache_resource
+def bootstrap_mapping(n):
+    """Loads the A/B assignment, writing its reference files on first run."""
+    import polars as pl
+
+    is_mixed_A = load_mixed_assignment(n)
+
+    # Persist mapping if needed
+    if not os.path.exists("mapping_reference.csv"):
+        mapping = {
+            "id": np.arange(len(is_mixed_A)),
+            "Mixed_is": np.where(is_mixed_A, "A", "B"),
+        }
+        pl.DataFrame(mapping).write_csv("mapping_reference.csv")
+    return is_mixed_A
+
+
+@st.cache_data
+def load_source_data(data_mtime):
+    """Loads the source recipes from the local CSV.
+
+    data_mtime is only there to key the cache on the CSV's modification time,
+    None means the CSV is missing.
+    """
+    import polars as pl
+
+    if data_mtime is None:
+        return pl.DataFrame()
+
+    cached = read_prepared_cache()
+    if cached is not None:
+        # Still ensures the mapping files exist when only the cache is left
+        bootstrap_mapping(len(cached))
+        return cached
+
+    # Adjust column names as needed based on your file
+    ce = pl.col("output_Qwen3-4B-Cross-Entropy")
+    mixed_out = pl.col("output_Qwen3-4B-Mixed")
+    mixed = pl.col("mixed")
+
+    # Only the used columns are parsed (ground truth and Gemini are skipped)
+    df = pl.scan_csv(DATA_FILE).select("title", ce, mixed_out).collect()
+    is_mixed_A = bootstrap_mapping(len(df))
+
+    # Outputs stay raw here, only the displayed pair gets parsed (get_pair)
+    prepared_data = (
+        df.with_columns(pl.Series("mixed", is_mixed_A))
+        .select(
+            "title",
+            A_raw=pl.when(mixed).then(mixed_out).otherwise(ce),
+            B_raw=pl.when(mixed).then(ce).otherwise(mixed_out),
+            # Track which model is behind each version
+            A_is=pl.when(mixed).then(pl.lit("Mixed")).otherwise(pl.lit("CE")),
+            B_is=pl.when(mixed).then(pl.lit("CE")).otherwise(pl.lit("Mixed")),
+        )
+        .with_row_index("ID")
+    )
+
+    write_prepared_cache(prepared_data)
+    return prepared_data
+
+
+def get_data_mtime():
+    """The CSV's modification time, used to key every cache on its content."""
+    return os.path.getmtime(DATA_FILE) if os.path.exists(DATA_FILE) else None
+
+
+@st.cache_data
+def get_pair(sample_id, data_mtime):
+    """Parses the two recipe versions of a single sample."""
+    data = load_source_data(data_mtime)
+    pair = data.select("A_raw", "B_raw").row(sample_id, named=True)
+    return {"A": parse_recipe(pair["A_raw"]), "B": parse_recipe(pair["B_raw"])}
+
+
+@st.cache_data
+def recipe_md(sample_id, side, data_mtime):
+    """Builds the markdown of one version ("A" or "B") of a sample."""
+    r = get_pair(sample_id, data_mtime)[side]
+    lines = ["#### Ingredients"]
+    ingredients = r.get("ingredients", [])
+    if isinstance(ingredients, list):
+        lines += [f"- {ing}" for ing in ingredients]
+    else:
+        lines.append(str(ingredients))
+    lines.append("#### Instructions")
+    inst = r.get("instructions", [])
+    if isinstance(inst, list):
+        lines += [f"**{i}.** {s}" for i, s in enumerate(inst, 1)]
+    else:
+        lines.append(str(inst))
+    return "\n\n".join(lines)
+
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import eval_core
+
+
+@pytest.fixture
+def mapping_file(tmp_path, monkeypatch):
+    path = tmp_path / "mapping.bin"
+    monkeypatch.setattr(eval_core, "MAPPING_FILE", str(path))
+    return path
+
+
+def seeded_draw(n):
+    np.random.seed(42)
+    return np.random.rand(n) < 0.5
+
+
+def test_mapping_is_persisted(mapping_file):
+    first = eval_core.load_mixed_assignment(64)
+    np.random.seed(0)  # Reloading must not depend on the global RNG
+    np.testing.assert_array_equal(eval_core.load_mixed_assignment(64), first)
+    np.testing.assert_array_equal(first, seeded_draw(64))
+
+
+def test_mapping_grows_within_padding(mapping_file):
+    # 65 rows are packed into 72 bits, rows 65-69 must not come from padding
+    eval_core.load_mixed_assignment(65)
+    np.testing.assert_array_equal(
+        eval_core.load_mixed_assignment(70), seeded_draw(70)
+    )
+
+
+def test_mapping_shrinks_to_prefix(mapping_file):
+    eval_core.load_mixed_assignment(70)
+    np.testing.assert_array_equal(
+        eval_core.load_mixed_assignment(10), seeded_draw(10)
+    )
+
+
+def test_mapping_without_row_count_is_redrawn(mapping_file):
+    # Bitmap written before the row count header was added
+    np.packbits(seeded_draw(64)).tofile(mapping_file)
+    np.testing.assert_array_equal(
+        eval_core.load_mixed_assignment(64), seeded_draw(64)
+    )